@@ -1,8 +1,9 @@
 import streamlit as st
 import pandas as pd
-import pdfplumber
 import re
-from io import BytesIO
+
+from pdf_text import extract_pages_text
+from xlsx_export import df_to_xlsx_bytes
 
 st.set_page_config(page_title="Invoice Parser", layout="centered")
 st.title("📑 Telstra, Optus & Vodafone Invoice Parser")
@@ -11,20 +12,45 @@ st.write("Upload a Telstra, Optus or Vodafone PDF invoice and download the extra
 uploaded_file = st.file_uploader("Upload Invoice (PDF)", type=["pdf"])
 
 
+# ---------------- HELPERS ----------------
+def _first_amount_by_number(pattern, text):
+    """Map each mobile number to the amount from its first match in text."""
+    amounts = {}
+    for number, amount in pattern.findall(text):
+        amounts.setdefault(number, amount)
+    return amounts
+
+
+def _with_spend_columns(cols, amounts):
+    """Build the plan DataFrame, converting raw GST-inclusive amount strings in one go."""
+    # Always float: to_numeric would infer int64 when every amount is whole
+    # dollars ("$60")
+    spend_incl = pd.to_numeric(
+        pd.Series(amounts, dtype=object).str.replace(",", "", regex=False),
+        errors="coerce",
+    ).astype("float64")
+    cols["Spend Excl GST"] = (spend_incl / 1.1).round(2)
+    cols["Spend Incl GST"] = spend_incl
+    return pd.DataFrame(cols)
+
+
 # ---------------- TELSTRA ----------------
-def parse_telstra(pdf):
-    data = []
+_RE_TELSTRA_MOBILE = re.compile(r"Mobile (\d{4}\s?\d{3}\s?\d{3})")
+_RE_TELSTRA_CHARGES = re.compile(r"(.+?)\s+\$([\d,]*\.\d{2})\s+\$([\d,]*\.\d{2})")
+
+
+def parse_telstra(pages_text):
+    cols = {"Mobile Number": [], "Plan Name": [], "Spend Excl GST": [], "Spend Incl GST": []}
     current_number = None
 
-    for page in pdf.pages:
-        text = page.extract_text()
+    for text in pages_text:
         if not text:
             continue
 
         lines = text.splitlines()
         for line in lines:
             # Detect mobile number
-            mnum = re.search(r"Mobile (\d{4}\s?\d{3}\s?\d{3})", line)
+            mnum = _RE_TELSTRA_MOBILE.search(line)
             if mnum:
                 current_number = mnum.group(1).replace(" ", "")
                 continue
@@ -32,105 +58,114 @@ def parse_telstra(pdf):
             # Detect plan + charges line
             if "Business" in line and ("Plan" in line or "Bundle" in line):
                 # Example: "Business Mobile Plan Basic - 10 Sep to 09 Oct   $63.64   $70.00"
-                m = re.match(r"(.+?)\s+\$([\d,]*\.\d{2})\s+\$([\d,]*\.\d{2})", line)
+                m = _RE_TELSTRA_CHARGES.match(line)
                 if m and current_number:
                     plan = m.group(1).strip()
                     spend_excl = float(m.group(2).replace(",", ""))
                     spend_incl = float(m.group(3).replace(",", ""))
-                    data.append({
-                        "Mobile Number": current_number,
-                        "Plan Name": plan,
-                        "Spend Excl GST": spend_excl,
-                        "Spend Incl GST": spend_incl,
-                    })
-    return pd.DataFrame(data)
+                    cols["Mobile Number"].append(current_number)
+                    cols["Plan Name"].append(plan)
+                    cols["Spend Excl GST"].append(spend_excl)
+                    cols["Spend Incl GST"].append(spend_incl)
+    return pd.DataFrame(cols)
 
 
 # ---------------- OPTUS ----------------
-def parse_optus(pdf):
-    data = []
-    full_text = " ".join([p.extract_text() or "" for p in pdf.pages])
-    for page in pdf.pages:
-        text = page.extract_text()
+_RE_OPTUS_PLAN = re.compile(r"(04\d{8}) on \$([\d,]*\.\d{2}|\d+)\s+(.+?M2M)")
+# The total after a number, as a lookahead so every occurrence of a number is
+# tried. The gap may hold the plan price, discount lines and dialled numbers
+# but stops at the next service's plan line ("04... on $"), so one service
+# never takes another's total. It is bounded so each number costs at most a
+# fixed-length scan; a total further away than that falls back to the plan price.
+_RE_OPTUS_TOTAL = re.compile(
+    r"(04\d{8})(?=(?:(?!04\d{8} on \$)[\s\S]){0,600}?Total Monthly Charges\s+\$([\d.]+))"
+)
+
+
+def parse_optus(pages_text, full_text):
+    cols = {"Mobile Number": [], "Plan Name": []}
+    amounts = []
+    totals = _first_amount_by_number(_RE_OPTUS_TOTAL, full_text)
+    for text in pages_text:
         if not text:
             continue
 
         # Pattern like "0403061668 on $60 Business Mobile Plus M2M"
-        matches = re.findall(r"(04\d{8}) on \$([\d,]*\.\d{2}|\d+)\s+(.+?M2M)", text)
+        matches = _RE_OPTUS_PLAN.findall(text)
         for m in matches:
             number, raw_price, plan = m
-            # Look for final monthly charge (after discounts)
-            disc_match = re.search(rf"{number}.*?Total Monthly Charges\s+\$([\d\.]+)", full_text, re.S)
-            spend = float(disc_match.group(1)) if disc_match else float(raw_price)
-            data.append({
-                "Mobile Number": number,
-                "Plan Name": plan.strip(),
-                "Spend Excl GST": round(spend/1.1, 2),
-                "Spend Incl GST": spend
-            })
-    return pd.DataFrame(data)
+            cols["Mobile Number"].append(number)
+            cols["Plan Name"].append(plan.strip())
+            # Prefer the final monthly charge (after discounts)
+            amounts.append(totals.get(number, raw_price))
+    return _with_spend_columns(cols, amounts)
 
 
 # ---------------- VODAFONE ----------------
-def parse_vodafone(pdf):
-    data = []
-    full_text = " ".join([p.extract_text() or "" for p in pdf.pages])
+_RE_VODAFONE_PLAN = re.compile(r"(04\d{8}) on \$([\d,]*\.\d{2}|\d+)\s+(.+?)(?:\s|$)")
+# The "Total Monthly Charges" after a number, bounded the same way as
+# _RE_OPTUS_TOTAL
+_RE_VODAFONE_OVERRIDE = re.compile(
+    r"(04\d{8})(?=(?:(?!04\d{8} on \$)[\s\S]){0,600}?Total Monthly Charges\s+\$([\d,]*\.\d{2}))"
+)
 
-    for page in pdf.pages:
-        text = page.extract_text()
+
+def parse_vodafone(pages_text, full_text):
+    cols = {"Mobile Number": [], "Plan Name": []}
+    amounts = []
+    overrides = _first_amount_by_number(_RE_VODAFONE_OVERRIDE, full_text)
+
+    for text in pages_text:
         if not text:
             continue
 
         # Pattern: "04XXXXXXXX on $XX.XX <PlanName>" or "$60"
-        matches = re.findall(r"(04\d{8}) on \$([\d,]*\.\d{2}|\d+)\s+(.+?)(?:\s|$)", text)
+        matches = _RE_VODAFONE_PLAN.findall(text)
         for m in matches:
             number, amt_str, plan = m
+            cols["Mobile Number"].append(number)
+            cols["Plan Name"].append(plan.strip())
+            # Optional override: the "Total Monthly Charges" for that number
+            amounts.append(overrides.get(number) or amt_str)
 
-            # Try to parse amount
-            try:
-                spend_incl = float(amt_str.replace(",", ""))
-            except:
-                spend_incl = None
-
-            # Optional override: look for "Total Monthly Charges" for that number
-            override = re.search(rf"{number}.*?\$([\d,]*\.\d{2})", full_text)
-            if override:
-                try:
-                    spend_incl = float(override.group(1).replace(",", ""))
-                except:
-                    pass
-
-            # Derive Excl GST
-            spend_excl = round(spend_incl / 1.1, 2) if spend_incl is not None else None
+    return _with_spend_columns(cols, amounts)
 
-            # Append result
-            data.append({
-                "Mobile Number": number,
-                "Plan Name": plan.strip(),
-                "Spend Excl GST": spend_excl,
-                "Spend Incl GST": spend_incl
-            })
 
-    return pd.DataFrame(data)
+# ---------------- UNIVERSAL ----------------
+def detect_provider(pages_text):
+    """Return the provider named anywhere in the invoice, Telstra > Optus > Vodafone."""
+    if any("Telstra Limited" in t or "telstra.com" in t.lower() for t in pages_text):
+        return "Telstra"
+    elif any("Optus Billing Services" in t or "Optus" in t for t in pages_text):
+        return "Optus"
+    elif any("Vodafone" in t or "Vodafone Pty" in t for t in pages_text):
+        return "Vodafone"
+    return "Unknown"
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def extract_invoice_data(file_bytes):
+    pages_text = extract_pages_text(file_bytes)
+    provider = detect_provider(pages_text)
+    if provider == "Telstra":
+        return parse_telstra(pages_text), provider
+    elif provider == "Optus":
+        return parse_optus(pages_text, " ".join(pages_text)), provider
+    elif provider == "Vodafone":
+        return parse_vodafone(pages_text, " ".join(pages_text)), provider
+    else:
+        return pd.DataFrame(), provider
 
 
-# ---------------- UNIVERSAL ----------------
-def extract_invoice_data(file):
-    with pdfplumber.open(file) as pdf:
-        full_text = " ".join([p.extract_text() or "" for p in pdf.pages])
-        if "Telstra Limited" in full_text or "telstra.com" in full_text.lower():
-            return parse_telstra(pdf), "Telstra"
-        elif "Optus Billing Services" in full_text or "Optus" in full_text:
-            return parse_optus(pdf), "Optus"
-        elif "Vodafone" in full_text or "Vodafone Pty" in full_text:
-            return parse_vodafone(pdf), "Vodafone"
-        else:
-            return pd.DataFrame(), "Unknown"
+# ---------------- EXPORT ----------------
+@st.cache_data(show_spinner=False, max_entries=8)
+def df_to_csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8")
 
 
 # ---------------- STREAMLIT APP ----------------
 if uploaded_file is not None:
-    df, provider = extract_invoice_data(uploaded_file)
+    df, provider = extract_invoice_data(uploaded_file.getvalue())
     if df.empty:
         st.warning(f"No mobile data found. Provider detected: {provider}. Double-check invoice format.")
     else:
@@ -138,21 +173,17 @@ if uploaded_file is not None:
         st.dataframe(df)
 
         # Excel download
-        towrite = BytesIO()
-        df.to_excel(towrite, index=False)
-        towrite.seek(0)
         st.download_button(
             label="📥 Download Excel",
-            data=towrite,
+            data=df_to_xlsx_bytes(df),
             file_name="invoice_data.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
         # CSV download
-        csv = df.to_csv(index=False).encode("utf-8")
         st.download_button(
             label="📥 Download CSV",
-            data=csv,
+            data=df_to_csv_bytes(df),
             file_name="invoice_data.csv",
             mime="text/csv"
         )
@@ -1,11 +1,13 @@
 import re
-import io
-from collections import defaultdict
+from functools import lru_cache
 
-import pdfplumber
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+from pdf_text import extract_pages_tables, extract_pages_text
+from xlsx_export import df_to_xlsx_bytes
+
 st.title("📱 Telstra Mobile Summary (OCR PDF → Excel)")
 
 st.markdown("""
@@ -28,8 +30,167 @@ uploaded_pdf = st.file_uploader(
 # Expand this list as needed when you see other country names in your data
 KNOWN_COUNTRIES = ["Fiji", "Nauru", "Chile", "Singapore", "USA", "UK"]
 
+# Compiled once at import; these run against every line of every page.
+_RE_MOBILE_HEADER = re.compile(r"Mobile\s+([0-9 ]{8,15})")
+# A service header proper: a line holding only "Mobile" and one whole mobile
+# number. Itemised lines such as "Call to Mobile 0411 222 333" or
+# "Mobile 0411 222 333 12:01 2 mins $0.00" don't match.
+_RE_SERVICE_HEADER = re.compile(r"(?m)^[ \t]*Mobile\s+(04\d{2} ?\d{3} ?\d{3})[ \t]*$")
+# Every Call & Usage / Service summary line in one pattern, so each line is
+# scanned once. The alternatives are deliberately not wrapped in groups: that
+# lets re skip straight to their first letters. The named groups say which
+# one matched. Keep the "call"/"charges" prefilter in parse_telstra_pdf in step.
+_RE_SUMMARY_LINE = re.compile(
+    r"National Direct.*?(?P<nat>\d+)\s*calls"
+    r"|Mobile Originated SMS.*?(?P<sms>\d+)\s*calls"
+    r"|Mobile Enhanced SMS.*?(?P<enh>\d+)\s*calls?"
+    r"|Call Diversion.*?(?P<div>\d+)\s*calls"
+    r"|Calls made O/S.*?(?P<calls_os>\d+)\s*calls"
+    r"|Calls received O/S.*?(?P<calls_rec>\d+)\s*calls"
+    r"|Data Usage Overseas.*?(?P<data_os>\d+)\s*calls?"
+    r"|Total call charges\s*\$?\s*(?P<call_ex>[\d.]+)\s*\$?\s*(?P<call_inc>[\d.]+)"
+    r"|Total service charges\s*\$?\s*(?P<svc_ex>[\d.]+)\s*\$?\s*(?P<svc_inc>[\d.]+)"
+)
+
+# m.lastgroup -> field whose count is replaced by the matched value
+_COUNT_GROUPS = {
+    "nat": "National Direct Calls",
+    "sms": "SMS (Mobile Originated)",
+    "enh": "Enhanced SMS",
+    "div": "Call Diversion Calls",
+    "calls_os": "Calls Made Overseas",
+    "calls_rec": "Calls Received Overseas",
+    "data_os": "Overseas Data Sessions",
+}
+
+# m.lastgroup -> (excl group, excl field, incl field) added to the totals
+_CHARGE_GROUPS = {
+    "call_inc": ("call_ex", "Total Call Charges (Excl GST)", "Total Call Charges (Incl GST)"),
+    "svc_inc": ("svc_ex", "Total Service Charges (Excl GST)", "Total Service Charges (Incl GST)"),
+}
+
+# Header fragments that mark a table's description / call type column
+_DESC_HEADERS = ("description", "call type", "number dialled", "number dialed")
+
+# Per-mobile numeric fields, in output column order, with the dtype of the
+# array each one is accumulated in
+_SUMMARY_FIELDS = {
+    "National Direct Calls": np.int64,
+    "SMS (Mobile Originated)": np.int64,
+    "Enhanced SMS": np.int64,
+    "Call Diversion Calls": np.int64,
+    "Calls Made Overseas": np.int64,
+    "Calls Received Overseas": np.int64,
+    "Overseas Data Sessions": np.int64,
+    "Total Call Charges (Excl GST)": np.float64,
+    "Total Call Charges (Incl GST)": np.float64,
+    "Total Service Charges (Excl GST)": np.float64,
+    "Total Service Charges (Incl GST)": np.float64,
+    "Total WAP Volume (KB)": np.int64,
+}
+
+
+@lru_cache(maxsize=256)
+def _key_columns(header: tuple) -> tuple:
+    """
+    Return the (Vol(KB), description, location) column indexes of a table
+    header row, None where the header has no such column.
 
-def parse_telstra_pdf(file_obj) -> pd.DataFrame:
+    Cached on the raw header row: an invoice repeats the same few table
+    headers on every page, so each is only worked out once.
+    """
+    # Normalise header row
+    header_lower = [(c or "").strip().lower() for c in header]
+
+    # Work out key columns
+    vol_idx = None
+    desc_idx = None
+    location_idx = None
+
+    for idx, h in enumerate(header_lower):
+        # Vol(KB) column
+        if "vol" in h and "kb" in h:
+            vol_idx = idx
+        # Description / number dialled / call type column
+        if any(x in h for x in _DESC_HEADERS):
+            desc_idx = idx
+        # Location column (for overseas)
+        if "location" in h:
+            location_idx = idx
+
+    return vol_idx, desc_idx, location_idx
+
+
+def _tally_tables(tables) -> tuple[int, set]:
+    """Return the WAP volume (KB) and overseas countries in one page's tables."""
+    wap_kb = 0
+    countries = set()
+
+    for tbl in tables:
+        if not tbl or len(tbl) < 2:
+            continue
+
+        vol_idx, desc_idx, location_idx = _key_columns(tuple(tbl[0]))
+
+        # If we don't even have a description column, it's unlikely to be one
+        # of the detailed call tables we care about
+        if desc_idx is None:
+            continue
+
+        # One pass over the rows collects what the table would contribute as
+        # either type while working out which type it is
+        is_overseas_data_table = False
+        is_wap_table = False
+        table_kb = 0
+        table_countries = set()
+
+        for row in tbl[1:]:
+            cells = [(c or "") for c in row]
+            row_text = " ".join(cells).lower()
+
+            # ---- Overseas Countries: ONLY from Data usage overseas (GST FREE) rows & Location column ----
+            # Any such row also makes this the Data usage overseas table
+            if "data usage overseas" in row_text and "gst free" in row_text:
+                is_overseas_data_table = True
+                if location_idx is not None and location_idx < len(cells):
+                    loc_val = cells[location_idx].strip()
+                    if loc_val:
+                        table_countries.add(loc_val)
+
+            # Any row with "wap" or "internet" in the description/call-type
+            # column makes this the Mobile WAP/Internet sessions table. The
+            # cell is only lowercased when the lowered row has one of them.
+            if (
+                not is_wap_table
+                and ("wap" in row_text or "internet" in row_text)
+                and desc_idx < len(cells)
+            ):
+                desc_cell = cells[desc_idx].lower()
+                if "wap" in desc_cell or "internet" in desc_cell:
+                    is_wap_table = True
+
+            # ---- WAP volume: ONLY from the Vol(KB) column ----
+            # int() ignores surrounding whitespace, so one conversion both
+            # validates and parses the cell. Empty cells are common and are
+            # skipped up front rather than by raising.
+            if vol_idx is not None and vol_idx < len(cells) and cells[vol_idx]:
+                try:
+                    table_kb += int(cells[vol_idx].replace(",", ""))
+                except ValueError:
+                    pass
+
+        # The overseas data table takes precedence: its Vol(KB) is not WAP usage
+        if is_overseas_data_table:
+            countries |= table_countries
+        elif is_wap_table:
+            wap_kb += table_kb
+
+    return wap_kb, countries
+
+
+# The spinner only shows while a PDF is actually parsed, not on cached reruns
+@st.cache_data(show_spinner="Processing PDF… this can take a little while for 100+ pages.", max_entries=8)
+def parse_telstra_pdf(pdf_bytes: bytes) -> pd.DataFrame:
     """
     Parse OCR'd Telstra invoice PDF and return one row per mobile service.
 
@@ -41,222 +202,123 @@ def parse_telstra_pdf(file_obj) -> pd.DataFrame:
       'Data usage overseas (GST FREE)' section in the itemised call details.
     - If no such rows exist for a mobile, Overseas Countries is left blank.
     """
-    mobiles = defaultdict(lambda: {
-        "National Direct Calls": 0,
-        "SMS (Mobile Originated)": 0,
-        "Enhanced SMS": 0,
-        "Call Diversion Calls": 0,
-        "Calls Made Overseas": 0,
-        "Calls Received Overseas": 0,
-        "Overseas Data Sessions": 0,
-        "Total Call Charges (Excl GST)": 0.0,
-        "Total Call Charges (Incl GST)": 0.0,
-        "Total Service Charges (Excl GST)": 0.0,
-        "Total Service Charges (Incl GST)": 0.0,
-        "Total WAP Volume (KB)": 0,
-        "Overseas Countries": set(),
-    })
-
-    with pdfplumber.open(file_obj) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            lines = [ln.rstrip() for ln in text.splitlines()]
-
-            # ---------- Identify which mobile this page belongs to ----------
-            m_header = re.search(r"Mobile\s+([0-9 ]{8,15})", text)
+    # One array per field with a row per mobile, grown as new mobiles appear
+    row_of = {}
+    capacity = 64
+    totals = {field: np.zeros(capacity, dtype=dtype) for field, dtype in _SUMMARY_FIELDS.items()}
+    countries = []
+
+    pages_text = extract_pages_text(pdf_bytes)
+
+    # Pages whose tables need reading, with the row of the mobile they belong to
+    table_pages = []
+
+    for page_number, text in enumerate(pages_text, start=1):
+        # ---------- Split the page into one block per service header ----------
+        # With one capture group, split() gives [prefix, raw1, body1, raw2, body2, ...]
+        parts = _RE_SERVICE_HEADER.split(text)
+        if len(parts) == 1:
+            # No service header: as before, the first "Mobile <number>" on the
+            # page owns the whole page
+            m_header = _RE_MOBILE_HEADER.search(text)
             if not m_header:
                 continue  # skip pages without a mobile header
+            parts = ["", m_header.group(1), text]
+
+        # Lines above the first header belong to the first mobile, and so do
+        # the page's tables
+        parts[2] = parts[0] + "\n" + parts[2]
+        page_row = None
 
-            raw = m_header.group(1)
-            digits = re.sub(r"\D", "", raw)
+        for raw, body in zip(parts[1::2], parts[2::2]):
+            # Both header patterns only capture digits and spaces
+            digits = raw.replace(" ", "")
             mobile = digits[-10:] if len(digits) >= 10 else digits
-            data = mobiles[mobile]
+            row = row_of.get(mobile)
+            if row is None:
+                row = row_of[mobile] = len(row_of)
+                countries.append(set())
+                if row == capacity:
+                    capacity *= 2
+                    for field, arr in totals.items():
+                        totals[field] = np.concatenate((arr, np.zeros_like(arr)))
+            if page_row is None:
+                page_row = row
 
             # ---------- Call & Usage + Service summaries (from text) ----------
-            for l in lines:
-                l_stripped = l.strip()
-
-                # Call & Usage counts
-                m_nat = re.search(r"National Direct.*?(\d+)\s*calls", l_stripped)
-                if m_nat:
-                    data["National Direct Calls"] = int(m_nat.group(1))
-
-                m_sms = re.search(r"Mobile Originated SMS.*?(\d+)\s*calls", l_stripped)
-                if m_sms:
-                    data["SMS (Mobile Originated)"] = int(m_sms.group(1))
-
-                m_enh = re.search(r"Mobile Enhanced SMS.*?(\d+)\s*calls?", l_stripped)
-                if m_enh:
-                    data["Enhanced SMS"] = int(m_enh.group(1))
-
-                m_div = re.search(r"Call Diversion.*?(\d+)\s*calls", l_stripped)
-                if m_div:
-                    data["Call Diversion Calls"] = int(m_div.group(1))
-
-                m_calls_os = re.search(r"Calls made O/S.*?(\d+)\s*calls", l_stripped)
-                if m_calls_os:
-                    data["Calls Made Overseas"] = int(m_calls_os.group(1))
-
-                m_calls_rec = re.search(r"Calls received O/S.*?(\d+)\s*calls", l_stripped)
-                if m_calls_rec:
-                    data["Calls Received Overseas"] = int(m_calls_rec.group(1))
-
-                m_data_os = re.search(r"Data Usage Overseas.*?(\d+)\s*calls?", l_stripped)
-                if m_data_os:
-                    data["Overseas Data Sessions"] = int(m_data_os.group(1))
-
-                # Total call charges
-                m_tot_call = re.search(
-                    r"Total call charges\s*\$?\s*([\d.]+)\s*\$?\s*([\d.]+)",
-                    l_stripped,
-                )
-                if m_tot_call:
-                    try:
-                        ex = float(m_tot_call.group(1))
-                        inc = float(m_tot_call.group(2))
-                        data["Total Call Charges (Excl GST)"] += ex
-                        data["Total Call Charges (Incl GST)"] += inc
-                    except ValueError:
-                        pass
+            for l in body.splitlines():
+                # Every summary pattern contains "call" or "charges", so most
+                # lines can be ruled out without running the regex
+                if "call" not in l and "charges" not in l:
+                    continue
+
+                # No need to strip: the pattern is unanchored, so surrounding
+                # whitespace cannot change what it finds
+                m = _RE_SUMMARY_LINE.search(l)
+                if not m:
+                    continue
 
-                # Total service charges
-                m_svc_tot = re.search(
-                    r"Total service charges\s*\$?\s*([\d.]+)\s*\$?\s*([\d.]+)",
-                    l_stripped,
-                )
-                if m_svc_tot:
+                group = m.lastgroup
+                if group in _COUNT_GROUPS:
+                    totals[_COUNT_GROUPS[group]][row] = int(m.group(group))
+                else:
+                    ex_group, ex_field, inc_field = _CHARGE_GROUPS[group]
                     try:
-                        ex = float(m_svc_tot.group(1))
-                        inc = float(m_svc_tot.group(2))
-                        data["Total Service Charges (Excl GST)"] += ex
-                        data["Total Service Charges (Incl GST)"] += inc
+                        ex = float(m.group(ex_group))
+                        inc = float(m.group(group))
+                        totals[ex_field][row] += ex
+                        totals[inc_field][row] += inc
                     except ValueError:
                         pass
 
-                        # ---------- Tables: WAP Vol(KB) + Overseas Location ----------
-            tables = page.extract_tables()
-            for tbl in tables:
-                if not tbl or len(tbl) < 2:
-                    continue
-
-                # Normalise header row
-                header = [(c or "").strip() for c in tbl[0]]
-                header_lower = [h.lower() for h in header]
-
-                # Work out key columns
-                vol_idx = None
-                desc_idx = None
-                location_idx = None
-
-                for idx, h in enumerate(header_lower):
-                    # Vol(KB) column
-                    if "vol" in h and "kb" in h:
-                        vol_idx = idx
-                    # Description / number dialled / call type column
-                    if any(x in h for x in ["description", "call type", "number dialled", "number dialed", "number dialled"]):
-                        desc_idx = idx
-                    # Location column (for overseas)
-                    if "location" in h:
-                        location_idx = idx
-
-                # If we don't even have a description column, it's unlikely to be one
-                # of the detailed call tables we care about
-                if desc_idx is None:
-                    continue
-
-                # First pass over rows to classify the table
-                is_overseas_data_table = False
-                is_wap_table = False
-
-                for row in tbl[1:]:
-                    cells = [(c or "") for c in row]
-                    cells_lower = [c.lower() for c in cells]
-                    row_text = " ".join(cells_lower)
-
-                    # If any row mentions "data usage overseas (gst free)", this is the
-                    # Data usage overseas table
-                    if "data usage overseas" in row_text and "gst free" in row_text:
-                        is_overseas_data_table = True
-                        break
-
-                if not is_overseas_data_table:
-                    # If any row in this table has "wap" or "internet" in the description/
-                    # call-type column, treat this table as the Mobile WAP/Internet sessions table.
-                    for row in tbl[1:]:
-                        cells = [(c or "") for c in row]
-                        if desc_idx < len(cells):
-                            desc_cell = (cells[desc_idx] or "").lower()
-                            if "wap" in desc_cell or "internet" in desc_cell:
-                                is_wap_table = True
-                                break
-
-                # Second pass: act based on the table type
-                for row in tbl[1:]:
-                    cells = [(c or "") for c in row]
-                    cells_lower = [c.lower() for c in cells]
-                    row_text = " ".join(cells_lower)
-
-                    # ---- WAP volume: ONLY from WAP table & Vol(KB) column ----
-                    if is_wap_table and vol_idx is not None and vol_idx < len(cells):
-                        vol_cell = cells[vol_idx].replace(",", "").strip()
-                        if vol_cell.isdigit():
-                            data["Total WAP Volume (KB)"] += int(vol_cell)
-
-                    # ---- Overseas Countries: ONLY from Data usage overseas (GST FREE) table & Location column ----
-                    if is_overseas_data_table and "data usage overseas" in row_text and "gst free" in row_text:
-                        if location_idx is not None and location_idx < len(cells):
-                            loc_val = cells[location_idx].strip()
-                            if loc_val:
-                                data["Overseas Countries"].add(loc_val)
+        # Table extraction is by far the slowest step per page, so only queue it
+        # when the page text has what _tally_tables counts: a Vol(KB) header
+        # with WAP/internet rows, or overseas data rows marked GST free. The
+        # "Data Usage Overseas" summary line on its own is not enough.
+        page_lower = text.lower()
+        has_wap_rows = (
+            ("wap" in page_lower or "internet" in page_lower)
+            and "vol" in page_lower
+            and "kb" in page_lower
+        )
+        has_overseas_rows = "overseas" in page_lower and "gst free" in page_lower
+        if has_wap_rows or has_overseas_rows:
+            table_pages.append((page_number, page_row))
+
+    # ---------- Tables: WAP Vol(KB) + Overseas Location ----------
+    # Only the queued pages are loaded for table detection
+    if table_pages:
+        page_tables = extract_pages_tables(pdf_bytes, [n for n, _ in table_pages])
+        for tables, (_, row) in zip(page_tables, table_pages):
+            wap_kb, page_countries = _tally_tables(tables)
+            totals["Total WAP Volume (KB)"][row] += wap_kb
+            countries[row] |= page_countries
 
     # ---------- Build final DataFrame ----------
-    rows = []
-    for mobile, d in mobiles.items():
-        countries_str = (
-            ", ".join(sorted(d["Overseas Countries"]))
-            if d["Overseas Countries"]
-            else ""
-        )
-        total_ex = d["Total Call Charges (Excl GST)"] + d["Total Service Charges (Excl GST)"]
-        total_inc = d["Total Call Charges (Incl GST)"] + d["Total Service Charges (Incl GST)"]
-
-        rows.append({
-            "Mobile Number": mobile,
-            "National Direct Calls": d["National Direct Calls"],
-            "SMS (Mobile Originated)": d["SMS (Mobile Originated)"],
-            "Enhanced SMS": d["Enhanced SMS"],
-            "Call Diversion Calls": d["Call Diversion Calls"],
-            "Calls Made Overseas": d["Calls Made Overseas"],
-            "Calls Received Overseas": d["Calls Received Overseas"],
-            "Overseas Data Sessions": d["Overseas Data Sessions"],
-            "Total Call Charges (Excl GST)": d["Total Call Charges (Excl GST)"],
-            "Total Call Charges (Incl GST)": d["Total Call Charges (Incl GST)"],
-            "Total Service Charges (Excl GST)": d["Total Service Charges (Excl GST)"],
-            "Total Service Charges (Incl GST)": d["Total Service Charges (Incl GST)"],
-            "Total WAP Volume (KB)": d["Total WAP Volume (KB)"],
-            "Overseas Countries": countries_str,
-            "Total Spend per Mobile (Excl GST)": total_ex,
-            "Total Spend per Mobile (Incl GST)": total_inc,
-        })
-
-    df = pd.DataFrame(rows)
-
-    if not df.empty:
-        df = (
-            df.sort_values(["Mobile Number", "Total Spend per Mobile (Incl GST)"])
-              .drop_duplicates(subset=["Mobile Number"], keep="last")
-        )
+    # There is one row per mobile number, so rows are already unique; taking
+    # them in number order gives the same order a sort of the finished frame would
+    numbers = sorted(row_of)
+    order = [row_of[n] for n in numbers]
+    cols = {"Mobile Number": numbers}
+    for field, arr in totals.items():
+        cols[field] = arr[order]
+    cols["Overseas Countries"] = [", ".join(sorted(countries[r])) for r in order]
+
+    df = pd.DataFrame(cols, copy=False)
+    df["Total Spend per Mobile (Excl GST)"] = (
+        df["Total Call Charges (Excl GST)"] + df["Total Service Charges (Excl GST)"]
+    )
+    df["Total Spend per Mobile (Incl GST)"] = (
+        df["Total Call Charges (Incl GST)"] + df["Total Service Charges (Incl GST)"]
+    )
 
     return df
 
 
-
 # ------------------ UI flow ------------------ #
 if uploaded_pdf:
-    st.info("Processing PDF… this can take a little while for 100+ pages.")
-
     try:
-        df_summary = parse_telstra_pdf(uploaded_pdf)
+        df_summary = parse_telstra_pdf(uploaded_pdf.getvalue())
     except Exception as e:
         st.error(f"Error while parsing PDF:\n\n{e}")
         st.stop()
@@ -272,15 +334,9 @@ if uploaded_pdf:
         st.subheader("Preview: Mobile Summary")
         st.dataframe(df_summary, use_container_width=True)
 
-        # Build Excel in memory
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-            df_summary.to_excel(writer, sheet_name="Mobile Summary", index=False)
-        buffer.seek(0)
-
         st.download_button(
             "Download Excel (Mobile Summary)",
-            data=buffer,
+            data=df_to_xlsx_bytes(df_summary, sheet_name="Mobile Summary"),
             file_name="telstra_mobile_summary.xlsx",
             mime=(
                 "application/vnd.openxmlformats-officedocument."
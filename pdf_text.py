@@ -0,0 +1,174 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+# PDFium is not thread-safe and Streamlit serves each session on its own
+# thread, so every call into pypdfium2 goes through this lock.
+_PDFIUM_LOCK = threading.Lock()
+
+# Pages each worker process must have before starting it is worth it: about
+# a second of extraction work (~1ms/page for PDFium, 80ms+ for pdfplumber)
+_PDFIUM_PAGES_PER_WORKER = 1000
+_PDFPLUMBER_PAGES_PER_WORKER = 16
+
+# Gaps (PDF points) that still count as the same word / the same line when
+# rebuilding lines from character boxes; pdfplumber's extract_text defaults
+_X_TOLERANCE = 3
+_Y_TOLERANCE = 3
+
+# Streamlit runs many threads, so never fork it directly: workers come from a
+# single-threaded fork server where the platform has one.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _count_pages(pdf_bytes: bytes) -> int:
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+
+def _pdfium_page_text(textpage) -> str:
+    """
+    Rebuild a page's text lines from PDFium's character boxes.
+
+    get_text_range() follows content-stream order, which splits visual lines
+    whenever the stream isn't written left to right, top to bottom; OCR text
+    layers often write each word or column as its own object. Every parser
+    here reads line by line, so characters are grouped into words, words
+    into lines by their height on the page, and lines sorted top to bottom,
+    the way pdfplumber lays out text.
+    """
+    rect = pdfium_c.FS_RECTF()
+    words = []  # [top, left, chars]
+    word = None
+    prev_left = prev_right = 0.0
+
+    for i in range(pdfium_c.FPDFText_CountChars(textpage)):
+        code = pdfium_c.FPDFText_GetUnicode(textpage, i)
+        if not code:
+            continue
+        ch = chr(code)
+        if ch.isspace() or not pdfium_c.FPDFText_GetLooseCharBox(textpage, i, rect):
+            word = None
+            continue
+
+        # Same word: touching the previous character on the same line
+        if (
+            word is not None
+            and abs(rect.top - word[0]) <= _Y_TOLERANCE
+            and rect.left <= prev_right + _X_TOLERANCE
+            and rect.right >= prev_left - _X_TOLERANCE
+        ):
+            word[2].append(ch)
+        else:
+            word = [rect.top, rect.left, [ch]]
+            words.append(word)
+        prev_left, prev_right = rect.left, rect.right
+
+    # PDF y grows upwards, so the highest words come first
+    words.sort(key=lambda w: -w[0])
+    lines = []
+    line = []
+    prev_top = None
+    for word in words:
+        if prev_top is not None and prev_top - word[0] > _Y_TOLERANCE:
+            lines.append(line)
+            line = []
+        line.append(word)
+        prev_top = word[0]
+    if line:
+        lines.append(line)
+
+    return "\n".join(
+        " ".join("".join(w[2]) for w in sorted(line, key=lambda w: w[1])) for line in lines
+    )
+
+
+def _pdfium_text(pdf_bytes: bytes, page_numbers: list[int]) -> list[str]:
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            pages_text = []
+            for n in page_numbers:
+                page = pdf[n - 1]
+                textpage = page.get_textpage()
+                pages_text.append(_pdfium_page_text(textpage.raw))
+                textpage.close()
+                page.close()
+            return pages_text
+        finally:
+            pdf.close()
+
+
+def _pdfplumber_map(extract_page, pdf_bytes: bytes, page_numbers: list[int]) -> list:
+    with pdfplumber.open(BytesIO(pdf_bytes), pages=page_numbers) as pdf:
+        results = []
+        for page in pdf.pages:
+            results.append(extract_page(page))
+            # Free the page's parsed chars/rects now instead of holding every
+            # page's objects until the PDF is closed
+            page.close()
+        return results
+
+
+def _pdfplumber_text(pdf_bytes: bytes, page_numbers: list[int]) -> list[str]:
+    return _pdfplumber_map(lambda p: p.extract_text() or "", pdf_bytes, page_numbers)
+
+
+def _pdfplumber_tables(pdf_bytes: bytes, page_numbers: list[int]) -> list[list]:
+    return _pdfplumber_map(pdfplumber.page.Page.extract_tables, pdf_bytes, page_numbers)
+
+
+def _map_pages(extract, pdf_bytes: bytes, page_numbers: list[int], pages_per_worker: int) -> list:
+    """Run extract over the given pages, split across processes when there are many."""
+    workers = min(os.cpu_count() or 1, len(page_numbers) // pages_per_worker)
+    if workers < 2:
+        return extract(pdf_bytes, page_numbers)
+
+    bounds = [len(page_numbers) * i // workers for i in range(workers + 1)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT) as ex:
+        chunks = ex.map(
+            extract,
+            [pdf_bytes] * workers,
+            [page_numbers[a:b] for a, b in zip(bounds, bounds[1:])],
+        )
+        return [result for chunk in chunks for result in chunk]
+
+
+def extract_pages_text(pdf_bytes: bytes) -> list[str]:
+    """
+    Return the text of every page in the PDF, one string per page.
+
+    PDFium is used for the text layer as it is several times faster than
+    pdfplumber/pdfminer, with lines rebuilt from character positions. If it yields no text at all we fall back to
+    pdfplumber, so callers always get the best text we can find. Large
+    PDFs are split into page ranges that are extracted in parallel.
+    """
+    page_numbers = list(range(1, _count_pages(pdf_bytes) + 1))
+
+    pages_text = _map_pages(_pdfium_text, pdf_bytes, page_numbers, _PDFIUM_PAGES_PER_WORKER)
+    if any(pages_text):
+        return pages_text
+
+    return _map_pages(_pdfplumber_text, pdf_bytes, page_numbers, _PDFPLUMBER_PAGES_PER_WORKER)
+
+
+def extract_pages_tables(pdf_bytes: bytes, page_numbers: list[int]) -> list[list]:
+    """
+    Return pdfplumber's extract_tables() for each of the given 1-based pages.
+
+    Table detection is the slowest thing we do per page, so when there are
+    enough pages the work is spread across processes like the text pass.
+    """
+    return _map_pages(_pdfplumber_tables, pdf_bytes, page_numbers, _PDFPLUMBER_PAGES_PER_WORKER)
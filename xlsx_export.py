@@ -0,0 +1,29 @@
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+import xlsxwriter
+
+# The format pandas' to_excel gives the header row
+_HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def df_to_xlsx_bytes(df: pd.DataFrame, sheet_name: str = "Sheet1") -> bytes:
+    """
+    Return df as a single-sheet workbook, laid out like df.to_excel(index=False).
+
+    xlsxwriter is driven directly rather than through pd.ExcelWriter, which
+    skips pandas' per-cell formatting layer. constant_memory mode flushes each
+    row once the next is started, so memory stays flat for large invoices,
+    but rows must be written in order. Missing values become blank cells.
+    """
+    buffer = BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True})
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, df.columns.tolist(), workbook.add_format(_HEADER_FORMAT))
+    columns = [df[col].astype(object).where(df[col].notna(), None).tolist() for col in df.columns]
+    for row_idx, row in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+    return buffer.getvalue()